@@ -1,21 +1,70 @@
 import aiohttp
 import aiofiles
+import functools
+import hashlib
 import os
 import tempfile
 import logging
 from urllib.parse import urlparse
-from typing import Tuple
+from typing import Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Documents up to this size stay in RAM; larger ones spill to a tempfile
+IN_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# Ordered (marker, type) tables for file-type detection; .doc must come
+# after .docx since it's a prefix of it
+_URL_TYPE_MARKERS = (
+    ('.pdf', 'pdf'),
+    ('.docx', 'docx'),
+    ('.doc', 'doc'),
+    ('.eml', 'email'),
+)
+_CONTENT_TYPE_MARKERS = (
+    ('pdf', 'pdf'),
+    ('wordprocessingml', 'docx'),
+    ('docx', 'docx'),
+    ('msword', 'doc'),
+    ('email', 'email'),
+    ('message', 'email'),
+)
+
+# Shared HTTP session: pools connections, reuses TLS handshakes and DNS lookups
+_http_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Return the process-wide pooled aiohttp session, creating it lazily"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300, enable_cleanup_closed=True)
+        )
+    return _http_session
+
+
+async def close_http_session():
+    """Close the shared session (called from application shutdown)"""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+def url_key(url: str) -> str:
+    """Short stable digest of a URL, safe for filenames and IDs across runs"""
+    return hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
+
 class DocumentDownloader:
     def __init__(self):
         self.temp_dir = tempfile.gettempdir()
         
-    async def download_document(self, url: str) -> Tuple[str, str]:
+    async def download_document(self, url: str) -> Tuple[object, str]:
         """
-        Download document from URL and return (file_path, file_type)
-        Returns: (local_file_path, detected_file_type)
+        Download document from URL and return (source, file_type).
+        `source` is the raw bytes for documents that fit in memory, or a
+        local file path for documents larger than IN_MEMORY_LIMIT.
         """
         try:
             logger.info(f"📥 Starting download from: {url}")
@@ -28,70 +77,101 @@ class DocumentDownloader:
             file_type = self._detect_file_type_from_url(url, filename)
             
             # Create temporary file path
-            temp_filename = f"hackrx_{hash(url)}_{filename}"
+            temp_filename = f"hackrx_{url_key(url)}_{filename}"
             file_path = os.path.join(self.temp_dir, temp_filename)
             
-            # Download the file
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        raise Exception(f"Failed to download: HTTP {response.status}")
-                    
-                    # Get content type from headers if available
-                    content_type = response.headers.get('content-type', '').lower()
-                    if not file_type:
-                        file_type = self._detect_file_type_from_content_type(content_type)
-                    
-                    # Save file
-                    async with aiofiles.open(file_path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
-                            await f.write(chunk)
-            
-            file_size = os.path.getsize(file_path)
-            logger.info(f"✅ Downloaded {file_size} bytes to: {file_path}")
+            # Download the file over the pooled session
+            session = get_http_session()
+            async with session.get(url) as response:
+                if response.status != 200:
+                    raise Exception(f"Failed to download: HTTP {response.status}")
+
+                # Get content type from headers if available
+                content_type = response.headers.get('content-type', '').lower()
+                if not file_type:
+                    file_type = self._detect_file_type_from_content_type(content_type)
+
+                # Keep the document in RAM; spill to a tempfile only if it
+                # grows past IN_MEMORY_LIMIT, avoiding the disk round-trip
+                content_length = int(response.headers.get('content-length', '0'))
+                buf = bytearray()
+                spilled = None
+                if 0 < content_length <= IN_MEMORY_LIMIT:
+                    # Known modest size: one read, no per-chunk event-loop hops
+                    buf = bytearray(await response.read())
+                else:
+                    # Unknown or large: stream in 1 MB chunks
+                    async for chunk in response.content.iter_chunked(1 << 20):
+                        if spilled is not None:
+                            await spilled.write(chunk)
+                        else:
+                            buf.extend(chunk)
+                            if len(buf) > IN_MEMORY_LIMIT:
+                                spilled = await aiofiles.open(file_path, 'wb')
+                                await spilled.write(bytes(buf))
+                                buf = bytearray()
+                    if spilled is not None:
+                        await spilled.close()
+
+            if spilled is not None:
+                file_size = os.path.getsize(file_path)
+                logger.info(f"✅ Downloaded {file_size} bytes to: {file_path}")
+                logger.info(f"🔍 Detected file type: {file_type}")
+                return file_path, file_type
+
+            logger.info(f"✅ Downloaded {len(buf)} bytes into memory")
             logger.info(f"🔍 Detected file type: {file_type}")
-            
-            return file_path, file_type
+            return bytes(buf), file_type
             
         except Exception as e:
             logger.error(f"❌ Download failed: {str(e)}")
             raise
     
-    def _detect_file_type_from_url(self, url: str, filename: str) -> str:
-        """Detect file type from URL or filename"""
+    async def get_validator(self, url: str) -> str:
+        """
+        Fetch the document's ETag/Last-Modified via a HEAD request, for cache
+        invalidation. Returns None if the server doesn't expose either.
+        """
+        try:
+            session = get_http_session()
+            async with session.head(url, allow_redirects=True) as response:
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                return etag or last_modified
+        except Exception as e:
+            logger.debug(f"⚠️ HEAD request failed for {url}: {str(e)}")
+            return None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _detect_file_type_from_url(url: str, filename: str) -> str:
+        """Detect file type from URL or filename (memoized — URLs repeat)"""
         url_lower = url.lower()
         filename_lower = filename.lower()
-        
-        if '.pdf' in url_lower or filename_lower.endswith('.pdf'):
-            return 'pdf'
-        elif '.docx' in url_lower or filename_lower.endswith('.docx'):
-            return 'docx'
-        elif '.doc' in url_lower or filename_lower.endswith('.doc'):
-            return 'doc'
-        elif '.eml' in url_lower or filename_lower.endswith('.eml'):
-            return 'email'
-        elif 'email' in url_lower or 'mail' in url_lower:
+
+        for marker, file_type in _URL_TYPE_MARKERS:
+            if marker in url_lower or filename_lower.endswith(marker):
+                return file_type
+        if 'email' in url_lower or 'mail' in url_lower:
             return 'email'
-        
+
         return None
-    
-    def _detect_file_type_from_content_type(self, content_type: str) -> str:
-        """Detect file type from HTTP content-type header"""
-        if 'pdf' in content_type:
-            return 'pdf'
-        elif 'wordprocessingml' in content_type or 'docx' in content_type:
-            return 'docx'
-        elif 'msword' in content_type:
-            return 'doc'
-        elif 'email' in content_type or 'message' in content_type:
-            return 'email'
-        
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _detect_file_type_from_content_type(content_type: str) -> str:
+        """Detect file type from HTTP content-type header (memoized)"""
+        for marker, file_type in _CONTENT_TYPE_MARKERS:
+            if marker in content_type:
+                return file_type
+
         return 'unknown'
-    
-    def cleanup_file(self, file_path: str):
-        """Clean up temporary file"""
+
+
+    def cleanup_file(self, file_path):
+        """Clean up temporary file (no-op for in-memory downloads)"""
         try:
-            if os.path.exists(file_path):
+            if isinstance(file_path, str) and os.path.exists(file_path):
                 os.remove(file_path)
                 logger.info(f"🗑️ Cleaned up: {file_path}")
         except Exception as e:
@@ -1,17 +1,26 @@
+import asyncio
 import docx
 import email
 from email import policy
+import hashlib
+import io
 import logging
 import os
-from typing import List
-import pdfplumber
+import pickle
+import tempfile
+from typing import List, Optional
+import fitz  # PyMuPDF
 
-from .document_downloader import DocumentDownloader
+from .document_downloader import DocumentDownloader, url_key
 from .models import DocumentChunk
 from .in_memory_vector_store import InMemoryVectorStore
 
 logger = logging.getLogger(__name__)
 
+# Disk cache of processed chunks, keyed by URL hash
+CHUNK_CACHE_DIR = os.getenv("CHUNK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "hackrx_chunk_cache"))
+CHUNK_CACHE_MAX_FILES = int(os.getenv("CHUNK_CACHE_MAX_FILES", "64"))
+
 
 class DocumentProcessor:
     """Handles the downloading, processing, and chunking of various document types."""
@@ -20,28 +29,76 @@ class DocumentProcessor:
         """Initializes the DocumentProcessor with an embedding service and a vector store."""
         self.embedding_service = embedding_service
         self.vector_store = vector_store
+        self.downloader = DocumentDownloader()
+
+    def _cache_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(CHUNK_CACHE_DIR, f"{key}.pkl")
+
+    def _load_cached_chunks(self, url: str, validator: Optional[str]) -> Optional[List[DocumentChunk]]:
+        """Return cached chunks for this URL if present and still valid"""
+        cache_path = self._cache_path(url)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if validator and cached.get('validator') and cached['validator'] != validator:
+                logger.info("🔄 Cached document is stale (ETag/Last-Modified changed)")
+                return None
+            # Touch for LRU eviction ordering
+            os.utime(cache_path)
+            return cached['chunks']
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to read chunk cache: {str(e)}")
+            return None
+
+    def _save_cached_chunks(self, url: str, validator: Optional[str], chunks: List[DocumentChunk]):
+        """Persist processed chunks to disk, evicting least-recently-used entries"""
+        try:
+            os.makedirs(CHUNK_CACHE_DIR, exist_ok=True)
+            with open(self._cache_path(url), 'wb') as f:
+                pickle.dump({'validator': validator, 'chunks': chunks}, f)
+
+            # LRU eviction by access time
+            entries = [os.path.join(CHUNK_CACHE_DIR, name) for name in os.listdir(CHUNK_CACHE_DIR)]
+            if len(entries) > CHUNK_CACHE_MAX_FILES:
+                entries.sort(key=lambda p: os.stat(p).st_atime)
+                for path in entries[:len(entries) - CHUNK_CACHE_MAX_FILES]:
+                    os.remove(path)
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to write chunk cache: {str(e)}")
 
     async def process_document_from_url(self, url: str) -> List[DocumentChunk]:
         """Download, process document from URL and return chunks (no storage)"""
-        downloader = DocumentDownloader()
+        downloader = self.downloader
         file_path = None
 
         try:
             logger.info(f"🔄 Processing document from URL: {url}")
 
-            # Download document
-            file_path, file_type = await downloader.download_document(url)
+            # Serve from the disk cache when the remote document is unchanged
+            validator = await downloader.get_validator(url)
+            cached_chunks = self._load_cached_chunks(url, validator)
+            if cached_chunks is not None:
+                logger.info(f"⚡ Loaded {len(cached_chunks)} chunks from disk cache")
+                return cached_chunks
+
+            # Download document (raw bytes for typical sizes, path if spilled)
+            source, file_type = await downloader.download_document(url)
+            file_path = source
 
-            # Extract text based on file type
+            # Extract text based on file type, off the event loop since
+            # extraction is synchronous CPU work
             if file_type == 'pdf':
-                text_content = self._extract_text_from_pdf(file_path)
+                text_content = await asyncio.to_thread(self._extract_text_from_pdf, source)
             elif file_type in ['docx', 'doc']:
-                text_content = self._extract_text_from_docx(file_path)
+                text_content = await asyncio.to_thread(self._extract_text_from_docx, source)
             elif file_type == 'email':
-                text_content = self._extract_text_from_email(file_path)
+                text_content = await asyncio.to_thread(self._extract_text_from_email, source)
             else:
                 logger.warning(f"⚠️ Unknown file type: {file_type}, trying PDF extraction")
-                text_content = self._extract_text_from_pdf(file_path)
+                text_content = await asyncio.to_thread(self._extract_text_from_pdf, source)
 
             if not text_content.strip():
                 raise ValueError("No text content found in document")
@@ -59,7 +116,7 @@ class DocumentProcessor:
             processed_chunks = []
             for i, (chunk_text, embedding) in enumerate(zip(chunks, embeddings)):
                 chunk = DocumentChunk(
-                    id=f"chunk_{i}_{hash(url)}",
+                    id=f"chunk_{i}_{url_key(url)}",
                     text=chunk_text,
                     metadata={
                         "source": url,
@@ -72,6 +129,8 @@ class DocumentProcessor:
                 )
                 processed_chunks.append(chunk)
 
+            self._save_cached_chunks(url, validator, processed_chunks)
+
             logger.info(f"✅ Processed {len(processed_chunks)} chunks from URL")
             return processed_chunks
 
@@ -83,17 +142,20 @@ class DocumentProcessor:
             if file_path:
                 downloader.cleanup_file(file_path)
 
-    def _extract_text_from_docx(self, file_path: str) -> str:
-        """Extract text from DOCX file"""
+    def _extract_text_from_docx(self, source) -> str:
+        """Extract text from DOCX file (path or raw bytes)"""
         try:
-            logger.info(f"📄 Extracting text from DOCX: {file_path}")
+            logger.info("📄 Extracting text from DOCX")
 
-            doc = docx.Document(file_path)
-            text_content = ""
+            if isinstance(source, (bytes, bytearray)):
+                doc = docx.Document(io.BytesIO(source))
+            else:
+                doc = docx.Document(source)
+            parts = []
 
             # Extract paragraphs
             for paragraph in doc.paragraphs:
-                text_content += paragraph.text + "\n"
+                parts.append(paragraph.text + "\n")
 
             # Extract tables
             for table in doc.tables:
@@ -101,8 +163,9 @@ class DocumentProcessor:
                     row_text = []
                     for cell in row.cells:
                         row_text.append(cell.text.strip())
-                    text_content += " | ".join(row_text) + "\n"
+                    parts.append(" | ".join(row_text) + "\n")
 
+            text_content = "".join(parts)
             logger.info(f"📊 Extracted {len(text_content)} characters from DOCX")
             return text_content.strip()
 
@@ -110,31 +173,40 @@ class DocumentProcessor:
             logger.error(f"❌ Failed to extract text from DOCX: {str(e)}")
             raise
 
-    def _extract_text_from_email(self, file_path: str) -> str:
-        """Extract text from email file"""
+    def _extract_text_from_email(self, source) -> str:
+        """Extract text from email file (path or raw bytes)"""
         try:
-            logger.info(f"📧 Extracting text from email: {file_path}")
+            logger.info("📧 Extracting text from email")
 
-            with open(file_path, 'rb') as f:
-                msg = email.message_from_bytes(f.read(), policy=policy.default)
+            if isinstance(source, (bytes, bytearray)):
+                raw = bytes(source)
+            else:
+                with open(source, 'rb') as f:
+                    raw = f.read()
+            msg = email.message_from_bytes(raw, policy=policy.default)
 
-            text_content = ""
+            parts = []
 
             # Extract headers
-            text_content += f"From: {msg.get('From', 'Unknown')}\n"
-            text_content += f"To: {msg.get('To', 'Unknown')}\n"
-            text_content += f"Subject: {msg.get('Subject', 'No Subject')}\n"
-            text_content += f"Date: {msg.get('Date', 'Unknown')}\n\n"
+            parts.append(f"From: {msg.get('From', 'Unknown')}\n")
+            parts.append(f"To: {msg.get('To', 'Unknown')}\n")
+            parts.append(f"Subject: {msg.get('Subject', 'No Subject')}\n")
+            parts.append(f"Date: {msg.get('Date', 'Unknown')}\n\n")
 
-            # Extract body
+            # Extract body: only decode text/plain parts so large binary
+            # attachments never materialize their payloads
             if msg.is_multipart():
                 for part in msg.walk():
+                    maintype = part.get_content_maintype()
+                    if maintype in ("multipart", "application"):
+                        continue
                     if part.get_content_type() == "text/plain":
-                        text_content += part.get_content()
+                        parts.append(part.get_content())
             else:
                 if msg.get_content_type() == "text/plain":
-                    text_content += msg.get_content()
+                    parts.append(msg.get_content())
 
+            text_content = "".join(parts)
             logger.info(f"📧 Extracted {len(text_content)} characters from email")
             return text_content.strip()
 
@@ -142,57 +214,94 @@ class DocumentProcessor:
             logger.error(f"❌ Failed to extract text from email: {str(e)}")
             raise
 
-    def _extract_text_from_pdf(self, file_path: str) -> str:
-        """Enhanced PDF extraction with better table handling"""
+    def _extract_text_from_pdf(self, source) -> str:
+        """PDF extraction via PyMuPDF with optional table handling"""
         try:
-            text_content = ""
+            # Table detection costs extra per page; most policy documents read
+            # fine as plain prose, so it can be switched off via env
+            extract_tables = os.getenv("EXTRACT_PDF_TABLES", "true").lower() == "true"
+            parts = []
 
-            with pdfplumber.open(file_path) as pdf:
-                logger.info(f"📊 Processing {len(pdf.pages)} pages with table extraction")
+            if isinstance(source, (bytes, bytearray)):
+                doc = fitz.open(stream=source, filetype="pdf")
+            else:
+                doc = fitz.open(source)
+            try:
+                logger.info(f"📊 Processing {len(doc)} pages with PyMuPDF")
 
-                for page_num, page in enumerate(pdf.pages):
+                for page_num, page in enumerate(doc):
                     if page_num % 10 == 0:
-                        logger.info(f"📄 Processing page {page_num + 1}/{len(pdf.pages)}")
+                        logger.debug("📄 Processing page %d/%d", page_num + 1, len(doc))
 
                     # Extract regular text
-                    page_text = page.extract_text()
+                    page_text = page.get_text("text")
                     if page_text:
-                        text_content += page_text + "\n"
+                        parts.append(page_text + "\n")
+
+                    if not extract_tables:
+                        continue
 
                     # Extract tables
-                    tables = page.extract_tables()
-                    for table_num, table in enumerate(tables):
-                        logger.debug(f"📊 Found table {table_num + 1} on page {page_num + 1}")
-                        text_content += f"\n[TABLE {table_num + 1} FROM PAGE {page_num + 1}]\n"
+                    for table_num, table in enumerate(page.find_tables()):
+                        logger.debug("📊 Found table %d on page %d", table_num + 1, page_num + 1)
+                        parts.append(f"\n[TABLE {table_num + 1} FROM PAGE {page_num + 1}]\n")
 
-                        for row in table:
+                        for row in table.extract():
                             if row:  # Skip empty rows
                                 # Clean and join row cells
                                 clean_row = [str(cell).strip() if cell else "" for cell in row]
-                                text_content += " | ".join(clean_row) + "\n"
+                                parts.append(" | ".join(clean_row) + "\n")
 
-                        text_content += "[END TABLE]\n\n"
+                        parts.append("[END TABLE]\n\n")
+            finally:
+                doc.close()
 
-            return text_content.strip()
+            return "".join(parts).strip()
 
         except Exception as e:
             logger.error(f"❌ Failed to extract text from PDF: {str(e)}")
             raise
     
     def _split_text_into_chunks(self, text_content: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        # This is a placeholder method for splitting text into chunks.
-        # A more robust implementation would use a library like LangChain's text splitters.
+        """
+        Split text into overlapping chunks aligned to paragraph boundaries.
+        One split pass plus a greedy packing loop, instead of re-slicing the
+        whole string with a sliding window.
+        """
         chunks = []
         if not text_content:
             return chunks
 
-        text_length = len(text_content)
-        start = 0
-        while start < text_length:
-            end = start + chunk_size
-            chunk = text_content[start:end]
-            chunks.append(chunk)
-            start += chunk_size - overlap
-            if start >= text_length:
-                break
+        paragraphs = text_content.split("\n")
+        cur: List[str] = []
+        cur_len = 0
+
+        for paragraph in paragraphs:
+            if cur and cur_len + len(paragraph) > chunk_size:
+                chunks.append("\n".join(cur))
+                # Keep tail paragraphs up to the overlap budget for context
+                tail: List[str] = []
+                tail_len = 0
+                for prev in reversed(cur):
+                    if tail_len + len(prev) > overlap:
+                        break
+                    tail.append(prev)
+                    tail_len += len(prev) + 1
+                cur = list(reversed(tail))
+                cur_len = tail_len
+            if len(paragraph) > chunk_size:
+                # Pathological paragraph with no line breaks: hard-slice it
+                for start in range(0, len(paragraph), chunk_size - overlap):
+                    chunks.append(paragraph[start:start + chunk_size])
+                cur = []
+                cur_len = 0
+            else:
+                cur.append(paragraph)
+                cur_len += len(paragraph) + 1
+
+        if cur:
+            chunk = "\n".join(cur)
+            if chunk.strip():
+                chunks.append(chunk)
+
         return chunks
\ No newline at end of file
@@ -4,6 +4,7 @@ import shutil
 import time
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Security, Depends
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -15,9 +16,11 @@ from .models import (
     # Keep original models if other endpoints use them
 )
 from .document_processor import DocumentProcessor
-from .query_processor import QueryProcessor
+from .query_processor import QueryProcessor, ERROR_ANSWER_PREFIXES
 from .embedding_service import EmbeddingService
 from .in_memory_vector_store import InMemoryVectorStore
+from .semantic_cache import semantic_cache
+from .document_downloader import close_http_session
 
 
 # --- Load Environment Variables ---
@@ -90,12 +93,14 @@ async def lifespan(app: FastAPI):
         raise
     finally:
         logger.info("🛑 Shutting down HackRX system...")
+        await close_http_session()
 
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="HackRX Insurance Claim System",
     description="LLM-powered document analysis for the HackRX competition.",
     version="2.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -125,31 +130,49 @@ async def health_check():
 
 @app.post("/hackrx/run", response_model=HackRXResponse)
 async def hackrx_run(request: HackRXRequest, credentials: HTTPAuthorizationCredentials = Security(verify_token)):
-    """Main competition endpoint with authentication and explicit memory cleanup"""
-    # Create temporary instances for this request
-    temp_vector_store = None
-    temp_query_processor = None
-
+    """Main competition endpoint with authentication"""
     try:
         start_time = time.time()
         logger.info(f"🔍 Processing HackRX request with {len(request.questions)} questions")
         logger.info(f"📄 Document URL: {request.documents}")
 
-        # Process document from URL
-        logger.info("📥 Downloading and processing document...")
-        chunks = await document_processor.process_document_from_url(request.documents)
-
-        if not chunks:
-            logger.error("❌ No content extracted from document")
-            return HackRXResponse(answers=["No content found in document"] * len(request.questions))
-
-        # Create temporary vector store for this request
-        temp_vector_store = InMemoryVectorStore()
-        temp_query_processor = QueryProcessor(embedding_service, temp_vector_store)
-
-        # Process all questions against the document
-        logger.info("🤖 Processing queries with LLM...")
-        answers = await temp_query_processor.process_batch_queries(request.questions, chunks)
+        # Embed every question in one batched encode call, then probe the
+        # semantic cache before doing any document work
+        question_embeddings = await embedding_service.generate_query_embeddings_batch(request.questions)
+        answers = [None] * len(request.questions)
+        pending_indices = []
+        for i, embedding in enumerate(question_embeddings):
+            cached_answer = semantic_cache.get(embedding, request.documents)
+            if cached_answer is not None:
+                answers[i] = cached_answer
+            else:
+                pending_indices.append(i)
+
+        if pending_indices:
+            # Process document from URL
+            logger.info("📥 Downloading and processing document...")
+            chunks = await document_processor.process_document_from_url(request.documents)
+
+            if not chunks:
+                logger.error("❌ No content extracted from document")
+                return HackRXResponse(answers=["No content found in document"] * len(request.questions))
+
+            # Process only the questions the cache couldn't answer. The
+            # process-lived processor and vector store are reused on purpose:
+            # a resubmission of the same document then skips the index rebuild
+            logger.info("🤖 Processing queries with LLM...")
+            pending_questions = [request.questions[i] for i in pending_indices]
+            pending_answers = await query_processor.process_batch_queries(pending_questions, chunks)
+
+            for i, answer in zip(pending_indices, pending_answers):
+                answers[i] = answer
+                # Never cache failure fallbacks; one transient error would
+                # otherwise answer similar questions for the cache TTL
+                if not answer.startswith(ERROR_ANSWER_PREFIXES):
+                    semantic_cache.put(question_embeddings[i], answer, request.documents)
+        else:
+            chunks = []
+            logger.info("⚡ All answers served from semantic cache")
 
         processing_time = time.time() - start_time
         logger.info(f"✅ Completed processing in {processing_time:.2f}s")
@@ -162,19 +185,6 @@ async def hackrx_run(request: HackRXRequest, credentials: HTTPAuthorizationCrede
         # Return error responses for all questions
         error_answers = [f"Unable to process question due to error: {str(e)}"] * len(request.questions)
         return HackRXResponse(answers=error_answers)
-    
-    finally:
-        # Explicit cleanup
-        if temp_vector_store:
-            temp_vector_store.clear()
-            logger.info("🧹 Explicitly cleared vector store memory")
-
-        # Clear temporary variables
-        temp_vector_store = None
-        temp_query_processor = None
-        chunks = None
-
-        logger.info("🧼 Request-specific memory cleanup completed")
 
 # --- Main Execution Block ---
 # Change this line in main.py
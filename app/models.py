@@ -1,3 +1,4 @@
+from dataclasses import dataclass, field
 from pydantic import BaseModel
 from typing import List, Optional, Any
 
@@ -21,15 +22,20 @@ class QueryResponse(BaseModel):
     justification: Optional[str] = None
     referenced_clauses: Optional[List[str]] = None
 
-class DocumentChunk(BaseModel):
+@dataclass(slots=True)
+class DocumentChunk:
     """
     Represents a single chunk of a document, including its text, metadata,
-    and vector embedding.
+    and vector embedding (a float32 numpy array, kept unconverted).
+
+    A plain slotted dataclass rather than a Pydantic model: chunks are
+    internal-only and created by the hundreds per request, so skipping
+    validation and __dict__ keeps them cheap.
     """
     id: str
     text: str
-    metadata: dict
-    embedding: Optional[List[float]] = None
+    metadata: dict = field(default_factory=dict)
+    embedding: Any = None
 
 class ProcessingResult(BaseModel):
     """
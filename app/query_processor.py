@@ -1,113 +1,337 @@
+import asyncio
+import datetime
+import hashlib
+import io
 import logging
 import os
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv  # Add this import
 load_dotenv()  # Add this line right here
 
 import google.generativeai as genai
-from typing import List, Dict
+import numpy as np
+from typing import List
 
 from .models import DocumentChunk
 from .in_memory_vector_store import InMemoryVectorStore
 
 logger = logging.getLogger(__name__)
 
-# Configure the API key from environment variables
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL = 3600.0
+
+# Gemini explicit caching refuses prefixes under ~2048 tokens; estimate at
+# 4 characters per token
+CONTEXT_CACHE_MIN_CHARS = 2048 * 4
+# CachedContent.create requires a fully versioned model id; the bare
+# "gemini-2.0-flash" alias is rejected
+CONTEXT_CACHE_MODEL = "gemini-2.0-flash-001"
+
+# Per-query context budget (~4k tokens at 4 chars/token); chunks near the
+# similarity threshold stop being added once this is spent
+MAX_CONTEXT_CHARS = 4096 * 4
+# Chunks scoring below this fraction of the best hit are dropped
+SIMILARITY_GAP_RATIO = 0.7
+
+# Static prompt fragments, built once; per-query prompts are a join of
+# these with the context and question. Documents stay ahead of the
+# question so the shared prefix remains implicit-cache eligible.
+_INSTRUCTIONS = ("Provide a direct answer that includes the main facts and any important "
+                 "conditions or limitations. Keep the response informative but concise - aim "
+                 "for 1 sentences for simple questions, or a short paragraph for complex ones.")
+_PROMPT_HEAD = ("Answer the question at the end using the provided policy documents. "
+                "Give a clear, concise answer with relevant context.\n\nPOLICY DOCUMENTS:\n")
+_PROMPT_MID = f"\n\n{_INSTRUCTIONS}\n\n---\nQUESTION: "
+_PROMPT_TAIL = "\n\nAnswer:"
+_CACHED_PROMPT_HEAD = ("Answer the question using the policy documents provided above. "
+                       "Give a clear, concise answer with relevant context.\n\n"
+                       f"{_INSTRUCTIONS}\n\nQUESTION: ")
+
+# Configure the API key from environment variables. Pin the gRPC transport
+# explicitly: the SDK then caches one channel per process, so concurrent
+# generate/embed calls share a persistent connection instead of paying a
+# TLS handshake each
 api_key = os.getenv("GEMINI_API_KEY")
 if api_key:
-    genai.configure(api_key=api_key)
+    genai.configure(api_key=api_key, transport="grpc")
+
+# Prefixes of the fallback strings returned when processing fails; callers
+# must not cache these as real answers
+ERROR_ANSWER_PREFIXES = (
+    "Unable to process this question",
+    "Unable to generate answer:",
+    "Processing error occurred",
+    "API key not configured",
+)
+
+# LRU+TTL cache of answers keyed by (query, context) hashes. Module-level,
+# like semantic_cache, so it outlives any single QueryProcessor and repeated
+# submissions of the same question over the same chunks skip the LLM
+_answer_cache: OrderedDict = OrderedDict()
+
+
+def _answer_cache_get(key):
+    entry = _answer_cache.get(key)
+    if entry is None:
+        return None
+    answer, ts = entry
+    if time.time() - ts > ANSWER_CACHE_TTL:
+        del _answer_cache[key]
+        return None
+    _answer_cache.move_to_end(key)
+    return answer
+
+
+def _answer_cache_put(key, answer: str):
+    _answer_cache[key] = (answer, time.time())
+    if len(_answer_cache) > ANSWER_CACHE_SIZE:
+        _answer_cache.popitem(last=False)
+
 
 class QueryProcessor:
     def __init__(self, embedding_service, vector_store):
         self.embedding_service = embedding_service
         self.vector_store = vector_store or InMemoryVectorStore()
         self.model_name = "gemini-2.0-flash"
+        # One client per processor; rebuilding it per question is wasted work
+        self.model = genai.GenerativeModel(self.model_name) if api_key else None
+        # Cap concurrent Gemini calls to respect rate limits
+        self.max_concurrency = int(os.getenv("QUERY_MAX_CONCURRENCY", "8"))
+        # Assembled context strings keyed by the retrieved chunk-index tuple;
+        # identical top-k sets across queries reuse one joined string
+        self._context_cache: OrderedDict = OrderedDict()
+        # Content hash of the batch currently indexed in the vector store
+        self._ingested_hash = None
+        # The store replaces its contents on ingest, so overlapping batches
+        # would swap documents out from under each other's searches; one
+        # batch owns the store at a time
+        self._batch_lock = asyncio.Lock()
 
     async def process_batch_queries(self, queries: List[str], document_chunks: List[DocumentChunk]) -> List[str]:
         """Process multiple questions against the same document context"""
         try:
-            logger.info(f"🔄 Processing {len(queries)} queries against {len(document_chunks)} document chunks")
-
-            # Store chunks in memory vector store
-            if isinstance(self.vector_store, InMemoryVectorStore):
-                self.vector_store.add_documents(document_chunks)
+            if not api_key:
+                logger.error("❌ GEMINI_API_KEY not configured, skipping batch")
+                return ["API key not configured for processing"] * len(queries)
 
-            answers = []
+            async with self._batch_lock:
+                logger.info("🔄 Processing %d queries against %d document chunks", len(queries), len(document_chunks))
 
-            for i, query in enumerate(queries):
-                logger.info(f"🔍 Processing query {i+1}/{len(queries)}: {query}")
+                # Index chunks only when the document actually changed; repeat
+                # submissions of the same content skip the rebuild. Ingestion
+                # overlaps with the batched query embedding below.
+                doc_hash = hashlib.sha256(
+                    b"\x00".join(chunk.text.encode() for chunk in document_chunks)
+                ).hexdigest()
+                if doc_hash != self._ingested_hash:
+                    ingest_task = asyncio.create_task(self.vector_store.aadd_documents(document_chunks))
+                    # Memoized prompt prefixes are keyed by chunk-index tuples,
+                    # which only mean anything within one document; drop them
+                    # before the store starts serving the new one
+                    self._context_cache.clear()
+                else:
+                    ingest_task = None
 
-                try:
-                    # Generate query embedding
-                    query_embedding = await self.embedding_service.generate_query_embedding(query)
+                # Embed every query in one batched encode call, concurrent with
+                # ingestion so neither waits on the other
+                emb_task = asyncio.create_task(self.embedding_service.generate_query_embeddings_batch(queries))
+                if ingest_task is not None:
+                    _, query_embeddings = await asyncio.gather(ingest_task, emb_task)
+                    # Record the hash only once indexing has actually succeeded;
+                    # a failed ingest must not make later retries skip it
+                    self._ingested_hash = doc_hash
+                else:
+                    query_embeddings = await emb_task
 
-                    # Search for relevant documents
-                    relevant_docs = self.vector_store.search_similar(query_embedding, top_k=10)
+                # Upload the shared document once as explicit cached content so
+                # each Gemini call only bills the question (90% prefix
+                # discount). Kept as locals threaded through the workers —
+                # never instance state — so one batch can never answer
+                # against another batch's cache
+                cached_content = cached_digest = None
+                if api_key and len(queries) > 1:
+                    cached_content, cached_digest = await asyncio.to_thread(
+                        self._create_context_cache, document_chunks)
 
-                    # Filter by similarity threshold
-                    filtered_docs = [doc for doc in relevant_docs if doc.get('similarity', 0) > 0.3]
+                try:
+                    # Fixed-size worker pool draining a queue: even a
+                    # hundreds-of-queries batch keeps exactly max_concurrency
+                    # Gemini calls in flight instead of scheduling everything
+                    # at once
+                    work: asyncio.Queue = asyncio.Queue()
+                    for i, query in enumerate(queries):
+                        work.put_nowait((i, query))
 
-                    if not filtered_docs:
-                        logger.warning(f"⚠️ No relevant documents found for query {i+1}")
-                        filtered_docs = relevant_docs[:5]  # Use top 5 anyway
+                    answers: List[str] = [None] * len(queries)
 
-                    # Generate answer using LLM
-                    result = await self._generate_single_answer(query, filtered_docs)
-                    answers.append(result)
+                    async def worker():
+                        while True:
+                            try:
+                                i, query = work.get_nowait()
+                            except asyncio.QueueEmpty:
+                                return
+                            answers[i] = await self._process_one(
+                                i, query, query_embeddings[i], len(queries),
+                                cached_content, cached_digest)
 
-                except Exception as e:
-                    logger.error(f"❌ Failed to process query {i+1}: {str(e)}")
-                    answers.append("Unable to process this question due to an error.")
+                    await asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, len(queries)))))
+                finally:
+                    if cached_content is not None:
+                        await asyncio.to_thread(self._delete_context_cache, cached_content)
 
-            logger.info(f"✅ Completed processing {len(answers)} queries")
-            return answers
+                logger.info("✅ Completed processing %d queries", len(answers))
+                return answers
 
         except Exception as e:
             logger.error(f"❌ Batch query processing failed: {str(e)}")
             return ["Processing error occurred."] * len(queries)
 
-    async def _generate_single_answer(self, query: str, relevant_docs: List[Dict]) -> str:
-        """Generate a single answer for a query"""
+    async def _process_one(self, i: int, query: str, query_embedding, total: int,
+                           cached_content, cached_digest) -> str:
+        """Retrieve context and answer a single query, never raising"""
+        logger.info("🔍 Processing query %d/%d: %s", i + 1, total, query)
+
         try:
-            if not api_key:
-                return "API key not configured for processing"
+            # Search for relevant documents (parallel index/score arrays)
+            indices, scores = self.vector_store.search_similar_arrays(query_embedding, top_k=10)
+
+            # Filter by similarity threshold and by gap to the best hit
+            # in one vectorized pass; weak stragglers inflate the prompt
+            # without improving the answer
+            keep = np.flatnonzero(scores > 0.3)
+            if len(keep) and scores[0] > 0:
+                keep = keep[scores[keep] >= SIMILARITY_GAP_RATIO * scores[0]]
+
+            if len(keep) == 0:
+                logger.warning("⚠️ No relevant documents found for query %d", i + 1)
+                keep = np.arange(min(5, len(indices)))  # Use top 5 anyway
+
+            # Cap total context at a token budget (results arrive best
+            # first, so this keeps the strongest chunks). Kept chunks
+            # stay as parallel lists — no per-chunk dicts
+            documents = self.vector_store.documents
+            kept_texts: List[str] = []
+            kept_indices: List[int] = []
+            context_chars = 0
+            for j in keep:
+                text = documents[indices[j]].text
+                if kept_texts and context_chars + len(text) > MAX_CONTEXT_CHARS:
+                    break
+                kept_texts.append(text)
+                kept_indices.append(int(indices[j]))
+                context_chars += len(text)
+
+            # Generate answer using LLM
+            return await self._generate_single_answer(
+                query, kept_texts, kept_indices, cached_content, cached_digest)
 
-            # Prepare context from relevant documents
-            context = self._prepare_context(relevant_docs)
+        except Exception as e:
+            logger.error("❌ Failed to process query %d: %s", i + 1, str(e))
+            return "Unable to process this question due to an error."
 
-            # Create focused prompt for single question
-            prompt = f"""Answer this specific question using the provided policy documents. Give a clear, concise answer with relevant context.
+    def _create_context_cache(self, document_chunks: List[DocumentChunk]):
+        """Return a (CachedContent, digest) pair for the document, or (None, None)"""
+        full_context = "\n\n".join(chunk.text for chunk in document_chunks)
+        if len(full_context) < CONTEXT_CACHE_MIN_CHARS:
+            logger.debug("📄 Document below explicit-cache minimum, using inline context")
+            return None, None
+        try:
+            cached_content = genai.caching.CachedContent.create(
+                model=CONTEXT_CACHE_MODEL,
+                contents=[full_context],
+                ttl=datetime.timedelta(minutes=10),
+            )
+            logger.info("⚡ Created Gemini context cache for the document prefix")
+            return cached_content, hashlib.sha256(full_context.encode()).digest()
+        except Exception as e:
+            # Not all models/accounts support explicit caching; fall back
+            logger.warning(f"⚠️ Explicit context caching unavailable: {str(e)}")
+            return None, None
 
-QUESTION: {query}
+    def _delete_context_cache(self, cached_content):
+        """Drop a batch's CachedContent so it stops accruing storage cost"""
+        try:
+            cached_content.delete()
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to delete context cache: {str(e)}")
 
-POLICY DOCUMENTS:
-{context}
+    async def _generate_single_answer(self, query: str, texts: List[str], indices: List[int],
+                                      cached_content=None, cached_digest=None) -> str:
+        """Generate a single answer for a query from its retrieved chunks"""
+        try:
+            if cached_content is not None:
+                # Document already lives server-side in the context cache;
+                # only the question goes over the wire
+                context_digest = cached_digest
+            else:
+                # Prepare the prompt prefix (instructions + context) from
+                # the relevant documents
+                prompt_prefix = self._prepare_prompt_prefix(texts, indices)
+                context_digest = hashlib.sha256(prompt_prefix.encode()).digest()
 
-Provide a direct answer that includes the main facts and any important conditions or limitations. Keep the response informative but concise - aim for 1 sentences for simple questions, or a short paragraph for complex ones.
+            cache_key = (hashlib.sha256(query.encode()).digest(), context_digest)
+            cached_answer = _answer_cache_get(cache_key)
+            if cached_answer is not None:
+                logger.debug("⚡ Answer cache hit for query: %s", query)
+                return cached_answer
 
-Answer:"""
+            if cached_content is not None:
+                prompt = "".join((_CACHED_PROMPT_HEAD, query, _PROMPT_TAIL))
+                model = genai.GenerativeModel.from_cached_content(cached_content)
+            else:
+                # Prefix is pre-rendered and cached; assembly is two concats
+                prompt = prompt_prefix + query + _PROMPT_TAIL
+                model = self.model
 
-            # Generate response
-            model = genai.GenerativeModel(self.model_name)
-            response = model.generate_content(prompt)
+            # Generate response without blocking the event loop
+            if hasattr(model, "generate_content_async"):
+                response = await model.generate_content_async(prompt)
+            else:
+                response = await asyncio.to_thread(model.generate_content, prompt)
 
             # Clean and return the response
             answer = response.text.strip()
 
-            # Remove any "Answer:" prefix if present
-            if answer.lower().startswith("answer:"):
-                answer = answer[7:].strip()
+            # Remove any "Answer:" prefix if present (lowercase only the
+            # first 7 chars rather than copying the whole answer)
+            if answer[:7].lower() == "answer:":
+                answer = answer[7:].lstrip()
+
+            _answer_cache_put(cache_key, answer)
 
-            logger.debug(f"✅ Generated answer: {answer[:100]}...")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("✅ Generated answer: %s...", answer[:100])
             return answer
 
         except Exception as e:
             logger.error(f"❌ Failed to generate answer: {str(e)}")
             return f"Unable to generate answer: {str(e)}"
 
-    def _prepare_context(self, relevant_docs: List[Dict]) -> str:
+    def _prepare_prompt_prefix(self, texts: List[str], indices: List[int]) -> str:
         """
-        A helper method to combine the text from relevant documents into a single string.
-        This is a placeholder implementation.
+        Render the full prompt prefix (instructions + joined chunk texts) up
+        to the question, memoized by the chunk-index tuple since queries over
+        a small corpus often share the same top-k set. The per-query prompt
+        is then just prefix + question + tail.
         """
-        context_parts = [doc['text'] for doc in relevant_docs if 'text' in doc]
-        return "\n\n---\n\n".join(context_parts)
\ No newline at end of file
+        key = tuple(indices)
+        prefix = self._context_cache.get(key)
+        if prefix is None:
+            # Stream into one buffer instead of materializing a parts list
+            buf = io.StringIO()
+            buf.write(_PROMPT_HEAD)
+            first = True
+            for text in texts:
+                if not first:
+                    buf.write("\n\n---\n\n")
+                buf.write(text)
+                first = False
+            buf.write(_PROMPT_MID)
+            prefix = buf.getvalue()
+            self._context_cache[key] = prefix
+            if len(self._context_cache) > 256:
+                self._context_cache.popitem(last=False)
+        else:
+            self._context_cache.move_to_end(key)
+        return prefix
\ No newline at end of file
@@ -0,0 +1,96 @@
+import numpy as np
+import logging
+import time
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+class SemanticQueryCache:
+    """
+    Process-wide cache of (query embedding -> answer) with cosine-similarity lookup.
+
+    A lookup hits when a cached query is within the similarity threshold AND was
+    answered against the same document URL, so repeat/similar questions skip both
+    retrieval and the LLM call entirely.
+    """
+
+    def __init__(self, hit_threshold: float = 0.9, dedup_threshold: float = 0.95,
+                 ttl_seconds: float = 300.0, max_size: int = 1024):
+        self.hit_threshold = hit_threshold
+        self.dedup_threshold = dedup_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.matrix: Optional[np.ndarray] = None  # [N, dim] float32, L2-normalized rows
+        self.entries: List[dict] = []  # parallel list: answer, doc_url, ts, last_used
+
+    def _normalize(self, embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _evict_expired(self):
+        now = time.time()
+        keep = [i for i, e in enumerate(self.entries) if now - e['ts'] <= self.ttl_seconds]
+        if len(keep) < len(self.entries):
+            self.entries = [self.entries[i] for i in keep]
+            self.matrix = self.matrix[keep] if keep else None
+
+    def get(self, query_embedding, doc_url: str) -> Optional[str]:
+        """Return a cached answer for a semantically similar query, or None"""
+        self._evict_expired()
+        if self.matrix is None:
+            return None
+
+        # Only entries answered against this document are eligible; a closer
+        # match cached for another URL must not mask a valid hit
+        candidates = [i for i, e in enumerate(self.entries) if e['doc_url'] == doc_url]
+        if not candidates:
+            return None
+
+        query_vector = self._normalize(query_embedding)
+        scores = self.matrix[candidates] @ query_vector
+        best = int(np.argmax(scores))
+        best_score = float(scores[best])
+
+        if best_score > self.hit_threshold:
+            entry = self.entries[candidates[best]]
+            entry['last_used'] = time.time()
+            logger.info(f"⚡ Semantic cache hit (similarity {best_score:.3f})")
+            return entry['answer']
+        return None
+
+    def put(self, query_embedding, answer: str, doc_url: str):
+        """Cache an answer, updating a near-duplicate entry in place if one exists"""
+        query_vector = self._normalize(query_embedding)
+        now = time.time()
+
+        if self.matrix is not None:
+            # Same doc_url restriction as get: score only this document's rows
+            candidates = [i for i, e in enumerate(self.entries) if e['doc_url'] == doc_url]
+            if candidates:
+                scores = self.matrix[candidates] @ query_vector
+                best = candidates[int(np.argmax(scores))]
+                if float(np.max(scores)) > self.dedup_threshold:
+                    # Near-duplicate query: refresh in place instead of adding a new row
+                    self.matrix[best] = query_vector
+                    self.entries[best] = {'answer': answer, 'doc_url': doc_url, 'ts': now, 'last_used': now}
+                    return
+
+        if len(self.entries) >= self.max_size:
+            # LRU eviction
+            lru = min(range(len(self.entries)), key=lambda i: self.entries[i]['last_used'])
+            self.entries.pop(lru)
+            self.matrix = np.delete(self.matrix, lru, axis=0)
+
+        row = query_vector.reshape(1, -1)
+        self.matrix = row if self.matrix is None else np.vstack([self.matrix, row])
+        self.entries.append({'answer': answer, 'doc_url': doc_url, 'ts': now, 'last_used': now})
+
+    def clear(self):
+        """Drop all cached entries"""
+        self.matrix = None
+        self.entries = []
+
+
+# Shared across requests for the life of the process
+semantic_cache = SemanticQueryCache()